@@ -1,10 +1,16 @@
-from fastapi import FastAPI, status, Response
+from fastapi import FastAPI, status, Response, Query
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
-from typing import List
-from engine import OrderSystem, OrderBook, Order, Stock
+from typing import Literal
+from itertools import islice
+from engine import OrderSystem, OrderBook, Order, Stock, Trade
+import logging, threading
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 order_system = OrderSystem()
+order_system_lock = threading.Lock()  # Serializes engine access across the threadpool workers
+logger = logging.getLogger(__name__)
 
 class StockModel(BaseModel):
     id: int
@@ -17,26 +23,23 @@ class OrderModel(BaseModel):
     action: int
     user_id: str
     created: str | None = None
-    order_id: str | None = None
+    order_id: int | None = None
     current_quantity: int | None = None
     status: int | None = None
     settled: str | None = None
     last_status_update: str | None = None
 
-class OrderBookModel(BaseModel):
-    buy_orders: list[OrderModel] | None = None
-    sell_orders: list[OrderModel] | None = None
-
-class TradeModel(BaseModel):
-    stock_id: int
-    best_buy_order_id: str
-    best_sell_order_id: str
-    trade_price: float
-    quantity: int
-    timestamp: str
+def __locked(func, *args):
+    """
+    Runs an OrderSystem routine while holding the OrderSystem lock. Meant to be dispatched through 'run_in_threadpool',
+    so that engine work never blocks the event loop.
+    :param func: Callable touching the OrderSystem
+    :param args: Positional arguments for the callable
+    :return: Whatever the callable returns
+    """
+    with order_system_lock:
+        return func(*args)
 
-class OrderSystemModel(BaseModel):
-    order_system: dict[int, OrderBookModel] = {}
 
 @app.get("/")
 async def entry():
@@ -48,7 +51,7 @@ async def create_order(order_model: OrderModel, response: Response):
     """
     Order creation endpoint.
     """
-    print(f"-> Received order request {order_model}")
+    logger.debug("-> Received order request %s", order_model)
     stock = Stock(
         id=order_model.stock.id,
         name=order_model.stock.name,
@@ -60,91 +63,140 @@ async def create_order(order_model: OrderModel, response: Response):
         action=order_model.action,
         user_id=order_model.user_id
     )
-    engine_response = order_system.add_order(order)
-    print(engine_response[1])
+    engine_response = await run_in_threadpool(__locked, order_system.add_order, order)
+    logger.debug(engine_response[1])
     if not engine_response[0]:
         response.status_code = status.HTTP_400_BAD_REQUEST
     return engine_response[1]
 
 
-def __order_mapper(order: Order) -> OrderModel:
+def __order_mapper(order: Order) -> dict:
     """
-    Mapper function, to help with mapping engine class to FastAPI REST model
+    Mapper function, to help with mapping engine class to a plain REST payload. Datetime fields are left as is, since
+    orjson serializes them natively.
     :param order: Order details
-    :return: Rest Template Model
+    :return: Dictionary, shaped after the OrderModel
     """
-    stock_model = StockModel(
-        id=order.stock.id,
-        name=order.stock.name,
-        price=order.stock.price
-    )
-    order_model = OrderModel(
-        stock=stock_model,
-        ordered_quantity=order.ordered_quantity,
-        action=order.action,
-        user_id=order.user_id,
-        created=str(order.created),
-        order_id=str(order.order_id),
-        current_quantity=order.current_quantity,
-        status=order.status,
-        settled=str(order.settled),
-        last_status_update=str(order.last_status_update)
-    )
-    return order_model
+    stock = order.stock
+    return {
+        "stock": {"id": stock.id, "name": stock.name, "price": stock.price},
+        "ordered_quantity": order.ordered_quantity,
+        "action": order.action,
+        "user_id": order.user_id,
+        "created": order.created,
+        "order_id": order.order_id,
+        "current_quantity": order.current_quantity,
+        "status": order.status,
+        "settled": order.settled,
+        "last_status_update": order.last_status_update
+    }
+
+def __order_book_mapper(order_book: OrderBook, depth: int | None = None, side: str | None = None) -> dict:
+    """
+    Mapper function, to help with mapping an engine OrderBook to a plain REST payload. Orders are mapped while walking
+    the book, so only the requested part of it is ever materialized.
+    :param order_book: OrderBook details
+    :param depth: Maximum number of orders to map per side, starting from the best price. None maps the whole side.
+    :param side: Either 'buy' or 'sell', to map a single side. None maps both sides.
+    :return: Dictionary, holding the buy & sell orders of the OrderBook
+    """
+    buy_orders, sell_orders = None, None
+    if side != "sell":
+        buy_orders = [__order_mapper(order) for order in islice(order_book.iter_buy_orders(), depth)]
+    if side != "buy":
+        sell_orders = [__order_mapper(order) for order in islice(order_book.iter_sell_orders(), depth)]
+    return {"buy_orders": buy_orders, "sell_orders": sell_orders}
+
 
-@app.get("/order/get_order_book/{stock_id}", response_model=OrderBookModel, status_code=status.HTTP_200_OK)
-async def get_order_book(stock_id: str, response: Response):
+def __order_system_mapper(stock_ids: list[int] | None, depth: int | None, side: str | None) -> dict:
+    """
+    Mapper function, to help with mapping the engine OrderSystem to a plain REST payload
+    :param stock_ids: Stock ids of the OrderBooks to map. None maps every OrderBook.
+    :param depth: Maximum number of orders to map per side of each OrderBook. None maps every order.
+    :param side: Either 'buy' or 'sell', to map a single side of each OrderBook.
+    :return: Dictionary, holding the requested OrderBooks keyed by stock id
+    """
+    order_books = order_system.get_order_system()
+    if stock_ids is None:
+        selected = order_books.items()
+    else:
+        selected = ((stock_id, order_books[stock_id]) for stock_id in stock_ids if stock_id in order_books)
+    return {
+        "order_system": {
+            stock_id: __order_book_mapper(order_book, depth, side)
+            for stock_id, order_book in selected
+        }
+    }
+
+
+@app.get("/order/get_order_book/{stock_id}", response_model=None, status_code=status.HTTP_200_OK)
+async def get_order_book(stock_id: str) -> ORJSONResponse:
     """
     Retrieve OrderBook for specific stock.
     """
     try:
-        order_book = order_system.get_order_book(int(stock_id))
+        order_book = await run_in_threadpool(
+            __locked, lambda: __order_book_mapper(order_system.get_order_book(int(stock_id))))
+    except KeyError:
+        return ORJSONResponse({"buy_orders": None, "sell_orders": None}, status_code=status.HTTP_404_NOT_FOUND)
+    return ORJSONResponse(order_book)
 
-        order_purchases = [__order_mapper(order) for order in order_book.buy_orders]
-        order_sales = [__order_mapper(order) for order in order_book.sell_orders]
+def __depth_mapper(order_book: OrderBook) -> dict:
+    """
+    Mapper function, to help with mapping the price levels of an engine OrderBook to a plain REST payload
+    :param order_book: OrderBook details
+    :return: Dictionary, holding the aggregated bid & ask levels of the OrderBook
+    """
+    return {
+        "bids": [{"price": price, "quantity": quantity, "orders": orders}
+                 for price, quantity, orders in order_book.bid_levels()],
+        "asks": [{"price": price, "quantity": quantity, "orders": orders}
+                 for price, quantity, orders in order_book.ask_levels()]
+    }
 
-        order_book_model = OrderBookModel(
-            buy_orders=order_purchases,
-            sell_orders=order_sales
-        )
+
+@app.get("/order/get_depth/{stock_id}", response_model=None, status_code=status.HTTP_200_OK)
+async def get_depth(stock_id: str) -> ORJSONResponse:
+    """
+    Retrieve the aggregated price levels (price, total quantity, order count) of the OrderBook for specific stock.
+    """
+    try:
+        depth = await run_in_threadpool(__locked, lambda: __depth_mapper(order_system.get_order_book(int(stock_id))))
     except KeyError:
-        response.status_code = status.HTTP_404_NOT_FOUND
-        order_book_model = OrderBookModel()
-    return order_book_model
+        return ORJSONResponse({"bids": None, "asks": None}, status_code=status.HTTP_404_NOT_FOUND)
+    return ORJSONResponse(depth)
 
-@app.get("/order/get_order_system", response_model=OrderSystemModel, status_code=status.HTTP_200_OK)
-async def get_order_system():
+@app.get("/order/get_order_system", response_model=None, status_code=status.HTTP_200_OK)
+async def get_order_system(stock_ids: list[int] | None = Query(None), depth: int | None = Query(None, ge=0),
+                           side: Literal["buy", "sell"] | None = None) -> ORJSONResponse:
     """
-    Retrieve OrderSystem.
+    Retrieve OrderSystem, optionally narrowed down to specific stocks, a single side, and the top 'depth' orders of
+    each side. Without any query parameters, every order of every OrderBook is returned.
     """
-    os = order_system.get_order_system()
-    order_system_model = OrderSystemModel()
-    for stock_id, order_book in os.items():
-        order_purchases = [__order_mapper(order) for order in order_book.buy_orders]
-        order_sales = [__order_mapper(order) for order in order_book.sell_orders]
-        order_book_model = OrderBookModel(
-            buy_orders=order_purchases,
-            sell_orders=order_sales
-        )
-        order_system_model.order_system[stock_id] = order_book_model
-    return order_system_model
+    return ORJSONResponse(await run_in_threadpool(__locked, __order_system_mapper, stock_ids, depth, side))
 
 
-@app.patch("/order/match_orders", response_model=List[TradeModel], status_code=status.HTTP_200_OK)
-async def match_orders():
+def __trade_mapper(trade: Trade) -> dict:
+    """
+    Mapper function, to help with mapping an engine Trade to a plain REST payload. The timestamp is left as is, since
+    orjson serializes it natively.
+    :param trade: Trade details
+    :return: Dictionary, holding the Trade's fields
+    """
+    return {
+        "stock_id": trade.stock_id,
+        "best_buy_order_id": trade.best_buy_order_id,
+        "best_sell_order_id": trade.best_sell_order_id,
+        "trade_price": trade.trade_price,
+        "quantity": trade.quantity,
+        "timestamp": trade.timestamp
+    }
+
+
+@app.patch("/order/match_orders", response_model=None, status_code=status.HTTP_200_OK)
+async def match_orders() -> ORJSONResponse:
     """
     Matches the orders and executes trades
     """
-    trades_list = order_system.match_orders()
-    trades_model_list = []
-    for trade in trades_list:
-        trade_model = TradeModel(
-           stock_id=trade.stock_id,
-           best_buy_order_id=trade.best_buy_order_id,
-           best_sell_order_id=trade.best_sell_order_id,
-           trade_price=trade.trade_price,
-           quantity=trade.quantity,
-           timestamp=str(trade.timestamp)
-        )
-        trades_model_list.append(trade_model)
-    return trades_model_list
+    trades_list = await run_in_threadpool(__locked, order_system.match_orders)
+    return ORJSONResponse([__trade_mapper(trade) for trade in trades_list])
@@ -1,7 +1,13 @@
-from sortedcontainers import SortedKeyList
+from collections import deque
 from enum import Enum
 from datetime import datetime
-import hashlib, math
+from operator import attrgetter
+import heapq, itertools, logging
+
+logger = logging.getLogger(__name__)
+_order_id_gen = itertools.count(1)  # Monotonic source of unique order ids
+_current_quantity = attrgetter('current_quantity')
+
 
 class Stock:
     """
@@ -9,6 +15,8 @@ class Stock:
     Stock is the trading unit that can be 'bought' or 'sold'.
     """
 
+    __slots__ = ('id', 'name', 'price')
+
     def __init__(self, id: int, name: str, price: float):
         """
         Class Initializer
@@ -28,11 +36,19 @@ class Order:
     whether it's being purchased or sold, and the time fields of the order.
     """
 
+    # Fields touched by the matching loop come first
+    __slots__ = ('current_quantity', 'price', 'action', 'status', 'stock', 'user_id', 'ordered_quantity', 'order_id',
+                 'created', 'settled', 'last_status_update')
+
     class OrderAction(Enum):
         BUY = 1
         SELL = 2
 
-    class OrderStatus(Enum):
+    class OrderStatus:
+        """
+        Plain integer constants rather than an Enum, so that the status stored on an order is always the same int
+        exposed through the API.
+        """
         OPEN = 1
         FILLED = 2
         PARTIAL_FILL = 3
@@ -51,9 +67,11 @@ class Order:
 
         Furthermore, the model supports the following fields, which are used throughout the lifetime of the model, but
         are initialized always with the same defaults.
+        :param price: The price of the ordered stock, copied onto the order to spare the matching engine a lookup
+                      through the stock.
         :param created: The datetime when the order was marked as OPEN
-        :param order_id: The unique identifier of the order. In this usecase, we calculate a hash from the order's
-                         content.
+        :param order_id: The unique identifier of the order. In this usecase, we draw the next value from a monotonic
+                         integer sequence.
         :param current_quantity: The number of stock items currently marked within the order. When the order is brand
                          new, the current_quantity will always match the ordered_quantity.
         :param status: The status of the order, which always starts as OPEN
@@ -65,27 +83,179 @@ class Order:
         self.action = action
         self.user_id = user_id
 
-        self.created = datetime.now()
-        self.order_id = hashlib.md5(
-            f"{stock.id}{ordered_quantity}{action}{user_id}{self.created}".encode('utf-8')).hexdigest()
+        now = datetime.now()
+        self.created = now
+        self.order_id = next(_order_id_gen)
         self.current_quantity = ordered_quantity
-        self.status = self.OrderStatus.OPEN.value
+        self.price = stock.price
+        self.status = self.OrderStatus.OPEN
         self.settled = None
-        self.last_status_update = datetime.now()
+        self.last_status_update = now
 
 
 class OrderBook:
     """
     An OrderBook class signifies a traditional order book in an order matching system.
-    It is composed of 2 sorted dictionary data structures, which track the buy & sell orders respectively.
+    Each side is a price-level book: a dictionary mapping every active price to a FIFO queue of the orders resting at
+    that price, together with a binary heap of prices, which tracks the BUY (bid, negated into a max-heap) & SELL (ask)
+    levels respectively. The price dictionaries hold the active set: draining a level only deletes its dictionary entry,
+    and the stale price is discarded from the heap once it surfaces at the top (a level reopened in the meantime is
+    pushed again, and its older copy discarded the same way). The best price of either side is cached, and only looked
+    up again once its level is drained.
     """
 
     def __init__(self):
         """
         Class Initializer.
         """
-        self.buy_orders = SortedKeyList(key=lambda order: order.stock.price)
-        self.sell_orders = SortedKeyList(key=lambda order: order.stock.price)
+        self.bids = {}
+        self.asks = {}
+        self._bid_heap = []
+        self._ask_heap = []
+        self._best_bid = None
+        self._best_ask = None
+
+    @property
+    def buy_orders(self) -> list:
+        """
+        Flattened view of the BUY side, in price-time priority (highest price first, then oldest order first).
+        :return: List of Orders
+        """
+        return list(self.iter_buy_orders())
+
+    @property
+    def sell_orders(self) -> list:
+        """
+        Flattened view of the SELL side, in price-time priority (lowest price first, then oldest order first).
+        :return: List of Orders
+        """
+        return list(self.iter_sell_orders())
+
+    def iter_buy_orders(self):
+        """
+        Lazily walks the BUY side in price-time priority. Only the active prices are sorted up front, so that callers
+        only interested in the top of the book do not pay for visiting the rest of its orders.
+        :return: Generator of Orders
+        """
+        for price in sorted(self.bids, reverse=True):
+            yield from self.bids[price]
+
+    def iter_sell_orders(self):
+        """
+        Lazily walks the SELL side in price-time priority. Only the active prices are sorted up front, so that callers
+        only interested in the top of the book do not pay for visiting the rest of its orders.
+        :return: Generator of Orders
+        """
+        for price in sorted(self.asks):
+            yield from self.asks[price]
+
+    def is_crossed(self) -> bool:
+        """
+        Checks whether the book can trade, i.e. the best bid is at or above the best ask.
+        :return: True if both sides are populated and crossed, False otherwise
+        """
+        buy_order, sell_order = self.best_bid(), self.best_ask()
+        return buy_order is not None and sell_order is not None and buy_order.price >= sell_order.price
+
+    def bid_levels(self) -> list:
+        """
+        Aggregated view of the BUY side, one entry per price level (highest price first).
+        :return: List of tuples, denoting the price, the total open quantity, and the number of orders at each level.
+        """
+        return [(price, sum(map(_current_quantity, self.bids[price])), len(self.bids[price]))
+                for price in sorted(self.bids, reverse=True)]
+
+    def ask_levels(self) -> list:
+        """
+        Aggregated view of the SELL side, one entry per price level (lowest price first).
+        :return: List of tuples, denoting the price, the total open quantity, and the number of orders at each level.
+        """
+        return [(price, sum(map(_current_quantity, self.asks[price])), len(self.asks[price]))
+                for price in sorted(self.asks)]
+
+    def add_bid(self, order: Order):
+        """
+        Queues a BUY order at the back of its price level, opening the level if this is the first order at that price.
+        :param order: An object of type 'Order'
+        """
+        price = order.price
+        level = self.bids.get(price)
+        if level is None:
+            level = self.bids[price] = deque()
+            heapq.heappush(self._bid_heap, -price)
+            if self._best_bid is not None and price > self._best_bid:
+                self._best_bid = price
+        level.append(order)
+
+    def add_ask(self, order: Order):
+        """
+        Queues a SELL order at the back of its price level, opening the level if this is the first order at that price.
+        :param order: An object of type 'Order'
+        """
+        price = order.price
+        level = self.asks.get(price)
+        if level is None:
+            level = self.asks[price] = deque()
+            heapq.heappush(self._ask_heap, price)
+            if self._best_ask is not None and price < self._best_ask:
+                self._best_ask = price
+        level.append(order)
+
+    def best_bid(self) -> Order:
+        """
+        Peeks the oldest order at the highest BUY price.
+        :return: The best BUY Order, or None if the side is empty
+        """
+        if self._best_bid is None:
+            heap = self._bid_heap
+            while heap and -heap[0] not in self.bids:  # Discards prices whose level was drained
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            self._best_bid = -heap[0]
+        return self.bids[self._best_bid][0]
+
+    def best_ask(self) -> Order:
+        """
+        Peeks the oldest order at the lowest SELL price.
+        :return: The best SELL Order, or None if the side is empty
+        """
+        if self._best_ask is None:
+            heap = self._ask_heap
+            while heap and heap[0] not in self.asks:  # Discards prices whose level was drained
+                heapq.heappop(heap)
+            if not heap:
+                return None
+            self._best_ask = heap[0]
+        return self.asks[self._best_ask][0]
+
+    def pop_bid(self) -> Order:
+        """
+        Removes the best BUY order, closing its price level once drained.
+        :return: The removed Order
+        """
+        if self._best_bid is None:
+            self.best_bid()
+        level = self.bids[self._best_bid]
+        order = level.popleft()
+        if not level:
+            del self.bids[self._best_bid]  # The price stays in the heap, until 'best_bid' discards it
+            self._best_bid = None
+        return order
+
+    def pop_ask(self) -> Order:
+        """
+        Removes the best SELL order, closing its price level once drained.
+        :return: The removed Order
+        """
+        if self._best_ask is None:
+            self.best_ask()
+        level = self.asks[self._best_ask]
+        order = level.popleft()
+        if not level:
+            del self.asks[self._best_ask]  # The price stays in the heap, until 'best_ask' discards it
+            self._best_ask = None
+        return order
 
 
 class Trade:
@@ -93,13 +263,15 @@ class Trade:
     A trade class which tracks every single trade transaction within the order book
     """
 
-    def __init__(self, stock_id: int, best_buy_order_id: str, best_sell_order_id: str, trade_price: float,
+    __slots__ = ('stock_id', 'best_buy_order_id', 'best_sell_order_id', 'trade_price', 'quantity', 'timestamp')
+
+    def __init__(self, stock_id: int, best_buy_order_id: int, best_sell_order_id: int, trade_price: float,
                  quantity: int, timestamp: datetime):
         """
         Class Initializer.
         :param stock_id: int, denoting the id of the stock present in the trade.
-        :param best_buy_order_id: str, denoting the id of the BUY order.
-        :param best_sell_order_id: str, denoting the id of the SALE order.
+        :param best_buy_order_id: int, denoting the id of the BUY order.
+        :param best_sell_order_id: int, denoting the id of the SALE order.
         :param trade_price: flt, denoting the price of the stock within the trade.
         :param quantity: int, denoting the amount of stock being traded.
         :param timestamp: datetime, denoting the time of the trade.
@@ -112,6 +284,77 @@ class Trade:
         self.timestamp = timestamp
 
 
+def match_order_book(stock_id: int, order_book: OrderBook) -> list:
+    """
+    Matches a single OrderBook until it is no longer crossed (the best bid is below the best ask), or either of its
+    sides runs out of orders. The comparison is done by peeking the best order within the SALE OrderBook (oldest order
+    at the lowest ask), and the best order within the BUY OrderBook (oldest order at the highest bid). The difference /
+    delta between the two Order amounts is subtracted from either booking. If that amount reaches 0, that booking is
+    considered FILLED, settled, and removed from its price level. If that amount does not reach 0, that booking is
+    considered as PARTIALLY_FILLED, and remains at the head of its price level for future matching. Every iteration of
+    this is recorded as a trade for audit purposes.
+    Kept as a free function, so that the book's accessors and the status constants can be bound to locals once per
+    book rather than resolved on every fill.
+    :param stock_id: Int, denoting the stock id of the OrderBook.
+    :param order_book: The OrderBook being matched.
+    :return: List of Trades executed on this OrderBook.
+    """
+    trades = []  # List to store executed trades
+    append_trade = trades.append
+    best_bid, best_ask = order_book.best_bid, order_book.best_ask
+    pop_bid, pop_ask = order_book.pop_bid, order_book.pop_ask
+    filled, partial_fill = Order.OrderStatus.FILLED, Order.OrderStatus.PARTIAL_FILL
+    while True:
+        buy_order = best_bid()
+        sell_order = best_ask()
+        if buy_order is None or sell_order is None:
+            logger.debug("Insufficient orders to trade.")
+            break
+        if buy_order.price < sell_order.price:  # The book is no longer crossed
+            break
+
+        now = datetime.now()
+        quantity = min(buy_order.current_quantity, sell_order.current_quantity)  # Amount filled on both sides
+        delta = buy_order.current_quantity - sell_order.current_quantity
+
+        if delta > 0:
+            buy_order.current_quantity = delta
+            buy_order.status = partial_fill
+            buy_order.last_status_update = now
+            sell_order.current_quantity = 0
+            sell_order.status = filled
+            sell_order.last_status_update = now
+            sell_order.settled = now
+            pop_ask()
+        elif delta < 0:
+            sell_order.current_quantity = -delta
+            sell_order.status = partial_fill
+            sell_order.last_status_update = now
+            buy_order.current_quantity = 0
+            buy_order.status = filled
+            buy_order.last_status_update = now
+            buy_order.settled = now
+            pop_bid()
+        else:  # When orders match exactly in quantity
+            buy_order.current_quantity, sell_order.current_quantity = 0, 0
+            buy_order.status, sell_order.status = filled, filled
+            buy_order.last_status_update, sell_order.last_status_update = now, now
+            buy_order.settled, sell_order.settled = now, now
+            pop_bid()
+            pop_ask()
+        append_trade(
+            Trade(
+                stock_id=stock_id,
+                best_buy_order_id=buy_order.order_id,
+                best_sell_order_id=sell_order.order_id,
+                trade_price=sell_order.price,
+                quantity=quantity,
+                timestamp=now
+            )
+        )
+    return trades
+
+
 class OrderSystem:
     """
     Main class, which tracks all OrderBooks and Orders within, as an OrderSystem.
@@ -123,6 +366,7 @@ class OrderSystem:
         Class Initializer.
         """
         self.order_system = {}
+        self._crossed = set()  # Stock ids of the OrderBooks which can currently trade
 
     def add_order(self, order: Order) -> (bool, str):
         """
@@ -138,71 +382,30 @@ class OrderSystem:
 
         # Adds the order on the appropriate OrderBook
         if order.action == Order.OrderAction.BUY.value:
-            self.order_system[order_system_key].buy_orders.add(order)
+            self.order_system[order_system_key].add_bid(order)
             response_msg = (True, f"Purchase order successfully added")
         elif order.action == Order.OrderAction.SELL.value:
-            self.order_system[order_system_key].sell_orders.add(order)
+            self.order_system[order_system_key].add_ask(order)
             response_msg = (True, f"Sale order successfully added")
         else:
             response_msg = (False, f"Unsupported order action, received: {order.action}")
+
+        # Flags the OrderBook for the next reconciliation, if the new order crossed it
+        if response_msg[0] and self.order_system[order_system_key].is_crossed():
+            self._crossed.add(order_system_key)
         return response_msg
 
     def match_orders(self) -> list:
         """
-        Reconciles all OrderBooks within the OrderSystem, by matching the BUY & SALE ledger. The comparison is done by
-        taking the end order within the SALE OrderBook (highest sale), and the taking the first order within the BUY
-        OrderBook (lowest purchase). The difference / delta between the two Order amounts is subtracted from either
-        booking. If that amount reaches 0, that booking is considered FILLED, and settled. If that amount does not reach
-        0, that booking is considered as PARTIALLY_FILLED, and remains open for future matching. Every iteration of this
-        is recorded as a trade for audit purposes.
+        Reconciles all OrderBooks within the OrderSystem, by matching the BUY & SALE ledger of each (see
+        'match_order_book'). Only OrderBooks which became crossed since the last reconciliation are visited, since
+        matching drains every book it visits until it is no longer crossed.
         :return: List of Trades, which denote the specifics of the exchange between stock.
         """
         trades = []  # List to store executed trades
-        for stock_id, order_book in self.order_system.items():
-            try:
-                best_sell_order = order_book.sell_orders[-1]
-                best_buy_order = order_book.buy_orders[0]
-            except IndexError:
-                print("Insufficient orders to trade.")
-                return trades
-
-            delta = best_buy_order.current_quantity - best_sell_order.current_quantity
-            sell_order = order_book.sell_orders.pop(-1)
-            buy_order = order_book.buy_orders.pop(0)
-
-            if delta > 0:
-                buy_order.current_quantity = delta
-                buy_order.status = Order.OrderStatus.PARTIAL_FILL
-                buy_order.last_status_update = datetime.now()
-                sell_order.current_quantity = 0
-                sell_order.status = Order.OrderStatus.FILLED
-                sell_order.last_status_update = datetime.now()
-                sell_order.settled = datetime.now()
-                self.add_order(buy_order)
-            elif delta < 0:
-                sell_order.current_quantity = math.sqrt(delta ** 2)
-                sell_order.status = Order.OrderStatus.PARTIAL_FILL
-                sell_order.last_status_update = datetime.now()
-                buy_order.current_quantity = 0
-                buy_order.status = Order.OrderStatus.FILLED
-                buy_order.last_status_update = datetime.now()
-                buy_order.settled = datetime.now()
-                self.add_order(sell_order)
-            else:  # When orders match exactly in quantity
-                buy_order.current_quantity, sell_order.current_quantity = 0, 0
-                buy_order.status, sell_order.status = Order.OrderStatus.FILLED, Order.OrderStatus.FILLED
-                buy_order.last_status_update, sell_order.last_status_update = datetime.now(), datetime.now()
-                buy_order.settled, sell_order.settled = datetime.now(), datetime.now()
-            trades.append(
-                Trade(
-                    stock_id=stock_id,
-                    best_buy_order_id=buy_order.order_id,
-                    best_sell_order_id=sell_order.order_id,
-                    trade_price=sell_order.stock.price,
-                    quantity=int(math.sqrt(delta ** 2)),
-                    timestamp=datetime.now()
-                )
-            )
+        for stock_id in self._crossed:
+            trades.extend(match_order_book(stock_id, self.order_system[stock_id]))
+        self._crossed.clear()
         return trades
 
     def get_order_system(self) -> dict:
@@ -1,5 +1,5 @@
 import unittest
-from src.engine import OrderSystem, Stock, Order
+from src.engine import OrderSystem, OrderBook, Stock, Order
 
 
 class TestOrderSystem(unittest.TestCase):
@@ -35,9 +35,13 @@ class TestOrderSystem(unittest.TestCase):
 
         trades = self.order_system.match_orders()
         self.assertEqual(len(trades), 1)
-        self.assertEqual(trades[0].quantity, 1)
+        self.assertEqual(trades[0].quantity, 4)
         self.assertEqual(trades[0].trade_price, self.stock.price)
 
+        # Check the remaining sale order keeps an integer quantity
+        self.assertEqual(sell_order.current_quantity, 1)
+        self.assertIsInstance(sell_order.current_quantity, int)
+
     def test_match_orders_partial_fill(self):
         buy_order = Order(self.stock, 6, Order.OrderAction.BUY.value, "1234")
         sell_order = Order(self.stock, 7, Order.OrderAction.SELL.value, "1234")
@@ -47,13 +51,160 @@ class TestOrderSystem(unittest.TestCase):
         self.order_system.add_order(buy_order2) # Do it again, to quantify remaining buy order after partial fill.
 
         trades = self.order_system.match_orders()
-        self.assertEqual(len(trades), 1)
-        self.assertEqual(trades[0].quantity, 1)
+        self.assertEqual(len(trades), 2)  # The sale residual is drained by the second buy order in the same pass
+        self.assertEqual([trade.quantity for trade in trades], [6, 1])
         self.assertEqual(trades[0].trade_price, self.stock.price)
 
         # Check remaining buy order
         remaining_buy_order = self.order_system.get_order_book(1).buy_orders[0]
-        self.assertEqual(remaining_buy_order.current_quantity, 6)
+        self.assertIs(remaining_buy_order, buy_order2)
+        self.assertEqual(remaining_buy_order.current_quantity, 5)
+        self.assertIsInstance(remaining_buy_order.current_quantity, int)
+        self.assertEqual(remaining_buy_order.status, Order.OrderStatus.PARTIAL_FILL)
+        self.assertEqual(buy_order.status, 2)  # Statuses are plain ints
+        self.assertEqual(sell_order.status, 2)
+
+    def test_match_orders_releases_filled_orders(self):
+        buy_order = Order(self.stock, 2, Order.OrderAction.BUY.value, "1234")
+        sell_order = Order(self.stock, 2, Order.OrderAction.SELL.value, "1234")
+        self.order_system.add_order(buy_order)
+        self.order_system.add_order(sell_order)
+
+        trades = self.order_system.match_orders()
+        self.assertEqual((trades[0].best_buy_order_id, trades[0].best_sell_order_id),
+                         (buy_order.order_id, sell_order.order_id))
+        self.assertIsInstance(trades[0].best_buy_order_id, int)
+        self.assertEqual(trades[0].quantity, 2)
+
+        # Filled orders, and their emptied price levels, are no longer referenced by the book
+        order_book = self.order_system.get_order_book(1)
+        self.assertEqual(order_book.bids, {})
+        self.assertEqual(order_book.asks, {})
+
+    def test_match_orders_partial_fill_keeps_priority(self):
+        sell_order = Order(self.stock, 5, Order.OrderAction.SELL.value, "1234")
+        later_sell_order = Order(self.stock, 5, Order.OrderAction.SELL.value, "5678")
+        buy_order = Order(self.stock, 3, Order.OrderAction.BUY.value, "1234")
+        self.order_system.add_order(sell_order)
+        self.order_system.add_order(later_sell_order)
+        self.order_system.add_order(buy_order)
+
+        trades = self.order_system.match_orders()
+        self.assertEqual(len(trades), 1)
+
+        # The residual is adjusted in place, ahead of the later order at the same price
+        order_book = self.order_system.get_order_book(1)
+        self.assertEqual(order_book.sell_orders, [sell_order, later_sell_order])
+        self.assertEqual(sell_order.current_quantity, 2)
+
+    def test_match_orders_not_crossed(self):
+        buy_order = Order(Stock(1, 'DummyStock', 90), 1, Order.OrderAction.BUY.value, "1234")
+        sell_order = Order(self.stock, 1, Order.OrderAction.SELL.value, "1234")
+        self.order_system.add_order(buy_order)
+        self.order_system.add_order(sell_order)
+
+        trades = self.order_system.match_orders()
+        self.assertEqual(len(trades), 0)
+        self.assertEqual(buy_order.current_quantity, 1)
+        self.assertEqual(sell_order.current_quantity, 1)
+
+    def test_match_orders_only_visits_crossed_books(self):
+        self.order_system.add_order(Order(self.stock, 1, Order.OrderAction.BUY.value, "1234"))
+        self.assertFalse(self.order_system.get_order_book(1).is_crossed())
+
+        self.order_system.add_order(Order(self.stock, 1, Order.OrderAction.SELL.value, "1234"))
+        self.assertTrue(self.order_system.get_order_book(1).is_crossed())
+        self.assertEqual(len(self.order_system.match_orders()), 1)
+
+        # Nothing new was added, so there is nothing left to match
+        self.assertEqual(len(self.order_system.match_orders()), 0)
+
+    def test_match_orders_skips_empty_books(self):
+        other_stock = Stock(2, 'OtherStock', 50)
+        self.order_system.add_order(Order(self.stock, 1, Order.OrderAction.BUY.value, "1234"))
+        self.order_system.add_order(Order(other_stock, 1, Order.OrderAction.BUY.value, "1234"))
+        self.order_system.add_order(Order(other_stock, 1, Order.OrderAction.SELL.value, "1234"))
+
+        trades = self.order_system.match_orders()
+        self.assertEqual(len(trades), 1)
+        self.assertEqual(trades[0].stock_id, 2)
+
+    def test_order_ids_are_unique(self):
+        first_order = Order(self.stock, 1, Order.OrderAction.BUY.value, "1234")
+        second_order = Order(self.stock, 1, Order.OrderAction.BUY.value, "1234")
+        self.assertIsInstance(first_order.order_id, int)
+        self.assertGreater(second_order.order_id, first_order.order_id)
+
+    def test_order_book_price_time_priority(self):
+        cheap_stock = Stock(1, 'DummyStock', 90)
+        first_buy = Order(self.stock, 1, Order.OrderAction.BUY.value, "1234")
+        second_buy = Order(self.stock, 1, Order.OrderAction.BUY.value, "5678")
+        cheap_buy = Order(cheap_stock, 1, Order.OrderAction.BUY.value, "1234")
+        self.order_system.add_order(cheap_buy)
+        self.order_system.add_order(first_buy)
+        self.order_system.add_order(second_buy)
+
+        order_book = self.order_system.get_order_book(1)
+        self.assertIs(order_book.best_bid(), first_buy)
+        self.assertEqual(order_book.buy_orders, [first_buy, second_buy, cheap_buy])
+
+    def test_order_book_iter_sell_orders(self):
+        expensive_sell = Order(Stock(1, 'DummyStock', 110), 1, Order.OrderAction.SELL.value, "1234")
+        sell_order = Order(self.stock, 1, Order.OrderAction.SELL.value, "1234")
+        self.order_system.add_order(expensive_sell)
+        self.order_system.add_order(sell_order)
+
+        order_book = self.order_system.get_order_book(1)
+        self.assertEqual(next(order_book.iter_sell_orders()), sell_order)
+        self.assertEqual(list(order_book.iter_sell_orders()), [sell_order, expensive_sell])
+        self.assertEqual(list(order_book.iter_buy_orders()), [])
+
+    def test_order_book_levels(self):
+        cheap_stock = Stock(1, 'DummyStock', 90)
+        self.order_system.add_order(Order(self.stock, 2, Order.OrderAction.BUY.value, "1234"))
+        self.order_system.add_order(Order(self.stock, 3, Order.OrderAction.BUY.value, "5678"))
+        self.order_system.add_order(Order(cheap_stock, 4, Order.OrderAction.BUY.value, "1234"))
+
+        order_book = self.order_system.get_order_book(1)
+        self.assertEqual(order_book.bid_levels(), [(100, 5, 2), (90, 4, 1)])
+        self.assertEqual(order_book.ask_levels(), [])
+
+    def test_order_book_best_price_cache(self):
+        order_book = OrderBook()
+        self.assertIsNone(order_book.best_ask())
+
+        sell_order = Order(self.stock, 1, Order.OrderAction.SELL.value, "1234")
+        order_book.add_ask(sell_order)
+        self.assertIs(order_book.best_ask(), sell_order)
+
+        # A better price replaces the cached top of book immediately
+        better_sell_order = Order(Stock(1, 'DummyStock', 95), 1, Order.OrderAction.SELL.value, "1234")
+        order_book.add_ask(better_sell_order)
+        self.assertIs(order_book.best_ask(), better_sell_order)
+
+        # Draining the top level falls back to the next price
+        self.assertIs(order_book.pop_ask(), better_sell_order)
+        self.assertIs(order_book.best_ask(), sell_order)
+
+    def test_order_book_reopened_price_level(self):
+        cheap_stock = Stock(1, 'DummyStock', 90)
+        buy_order = Order(self.stock, 1, Order.OrderAction.BUY.value, "1234")
+        cheap_buy = Order(cheap_stock, 1, Order.OrderAction.BUY.value, "1234")
+        self.order_system.add_order(buy_order)
+        self.order_system.add_order(cheap_buy)
+
+        # Draining the top level falls back to the next price
+        order_book = self.order_system.get_order_book(1)
+        self.assertIs(order_book.pop_bid(), buy_order)
+        self.assertIs(order_book.best_bid(), cheap_buy)
+
+        # Reopening the level makes it the best bid once again
+        reopened_buy = Order(self.stock, 1, Order.OrderAction.BUY.value, "5678")
+        self.order_system.add_order(reopened_buy)
+        self.assertIs(order_book.best_bid(), reopened_buy)
+        self.assertIs(order_book.pop_bid(), reopened_buy)
+        self.assertIs(order_book.pop_bid(), cheap_buy)
+        self.assertIsNone(order_book.best_bid())
 
     def test_match_orders_no_orders(self):
         trades = self.order_system.match_orders()